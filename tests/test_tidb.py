@@ -0,0 +1,206 @@
+import logging
+
+import pymysql
+import pytest
+from vectordb_bench.backend.clients import MetricType
+from vectordb_bench.backend.clients.tidb_serverless import tidb
+from vectordb_bench.backend.clients.tidb_serverless.tidb import TiDBServeless
+from vectordb_bench.backend.clients.tidb_serverless.config import TiDBServerlessIndexConfig
+
+
+log = logging.getLogger(__name__)
+
+""" Tests for the TiDB Serverless client statement building and insert transactions,
+    runs against an in-memory fake connection, no TiDB server is needed."""
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = None
+
+    def execute(self, query, args=None):
+        if isinstance(query, bytes):
+            if self.conn.fail_on is not None and self.conn.fail_on in query:
+                raise pymysql.err.IntegrityError(1062, "Duplicate entry")
+            self.conn.pending.append(query)
+        elif "tiflash_replica" in query:
+            poll = self.conn.polls.pop(0)
+            if isinstance(poll, Exception):
+                raise poll
+            self.result = poll
+        return 0
+
+    def fetchone(self):
+        return (self.result,)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeConnection:
+    """Records INSERT statements, pending ones are kept only on commit,
+    TiFlash progress polls answer from polls, an exception is raised instead of returned"""
+
+    def __init__(self, committed: list, fail_on: bytes | None = None, polls: list | None = None):
+        self.committed = committed
+        self.fail_on = fail_on
+        self.polls = polls if polls is not None else []
+        self.pending = []
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self)
+
+    def begin(self):
+        self.pending = []
+
+    def commit(self):
+        self.committed.append(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+    def close(self):
+        self.closed = True
+
+
+def new_client(dim: int = 4) -> TiDBServeless:
+    return TiDBServeless(
+        dim=dim,
+        db_config={"database": "test"},
+        db_case_config=TiDBServerlessIndexConfig(metric_type=MetricType.COSINE),
+        collection_name="tidb_test",
+    )
+
+
+def new_loaded_client(committed: list, fail_on: bytes | None = None, polls: list | None = None) -> tuple[TiDBServeless, list]:
+    """Client on fake connections, returns it with every connection it opens in order"""
+    db = new_client()
+    db._insert_txn_rows = 100
+    conns = []
+
+    def connect():
+        conns.append(FakeConnection(committed, fail_on, polls))
+        return conns[-1]
+
+    db._ensure_connection = connect
+    db._fetch_max_stmt_length = lambda: 1024 * 1024
+    return db, conns
+
+
+def inserted_ids(statements: list[bytes]) -> list[int]:
+    ids = []
+    for stmt in statements:
+        values = stmt.split(b" VALUES ", 1)[1]
+        ids.extend(int(row.split(b",", 1)[0]) for row in values[1:-1].split(b"),("))
+    return ids
+
+
+class TestTiDB:
+    def test_insert_rows_split_at_max_stmt_length(self):
+        db = new_client()
+        # same width ids keep every row the same length
+        rows = [db._insert_row_fmt % (i, 0.5, 0.25, -1.0, 1e-07) for i in range(10, 30)]
+        prefix_length = len(db._insert_sql_prefix)
+        # room for three rows and their separators per statement
+        db._max_stmt_length = prefix_length + 3 * (len(rows[0]) + 1)
+
+        cursor = FakeCursor(FakeConnection([]))
+        db._insert_rows(cursor, rows)
+        statements = cursor.conn.pending
+
+        assert len(statements) == 7
+        assert all(len(stmt) <= db._max_stmt_length for stmt in statements)
+        assert inserted_ids(statements) == list(range(10, 30))
+
+    def test_insert_rows_sends_oversized_row(self):
+        db = new_client()
+        rows = [db._insert_row_fmt % (i, 0.5, 0.25, -1.0, 1e-07) for i in range(3)]
+        db._max_stmt_length = len(db._insert_sql_prefix) + len(rows[0]) // 2
+
+        cursor = FakeCursor(FakeConnection([]))
+        db._insert_rows(cursor, rows[:1])
+        assert cursor.conn.pending == [db._insert_sql_prefix + rows[0]]
+
+        cursor.conn.pending.clear()
+        db._insert_rows(cursor, rows)
+        assert [inserted_ids([stmt]) for stmt in cursor.conn.pending] == [[0], [1], [2]]
+
+    def test_insert_commits_every_txn_rows(self):
+        committed = []
+        db, _ = new_loaded_client(committed)
+
+        with db.init():
+            embeddings = [[0.5, 0.25, -1.0, 1e-07]] * 250
+            count, error = db.insert_embeddings(embeddings, list(range(250)))
+
+        assert error is None
+        assert count == 250
+        assert [inserted_ids(txn) for txn in committed] == [list(range(0, 100)), list(range(100, 200)), list(range(200, 250))]
+
+    def test_insert_failure_reports_committed_prefix(self):
+        committed = []
+        db, _ = new_loaded_client(committed, fail_on=b"(550,")
+
+        with db.init():
+            embeddings = [[0.5, 0.25, -1.0, 1e-07]] * 1000
+            count, error = db.insert_embeddings(embeddings, list(range(1000)))
+
+        assert isinstance(error, pymysql.err.IntegrityError)
+        # transactions before the failing one stay committed, the failing one rolls back
+        assert count == 500
+        assert [i for txn in committed for i in inserted_ids(txn)] == list(range(500))
+
+    def test_insert_failure_replaces_connection(self):
+        committed = []
+        db, conns = new_loaded_client(committed, fail_on=b"(5,")
+        embeddings = [[0.5, 0.25, -1.0, 1e-07]] * 10
+
+        with db.init():
+            count, error = db.insert_embeddings(embeddings, list(range(10)))
+            assert count == 0
+            assert isinstance(error, pymysql.err.IntegrityError)
+            assert conns[0].closed
+            assert db.conn is conns[1]
+
+            # the runner retries the remaining rows inside the same init() context
+            db.conn.fail_on = None
+            count, error = db.insert_embeddings(embeddings[5:], list(range(5, 10)))
+
+        assert (count, error) == (5, None)
+        assert committed == conns[1].committed
+        assert [i for txn in committed for i in inserted_ids(txn)] == list(range(5, 10))
+
+    def test_optimize_reconnects_after_lost_connection(self, monkeypatch):
+        monkeypatch.setattr(tidb.time, "sleep", lambda _: None)
+        polls = [pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query"), 0.5, 1]
+        db, conns = new_loaded_client([], polls=polls)
+
+        with db.init():
+            first_conn, first_cursor = db.conn, db.cursor
+            db.optimize()
+            assert db.conn is conns[1]
+            assert db.cursor is not first_cursor
+            assert first_conn.closed
+
+        assert polls == []
+
+    def test_optimize_gives_up_after_max_reconnect_attempts(self, monkeypatch):
+        monkeypatch.setattr(tidb.time, "sleep", lambda _: None)
+        polls = [pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")] * (tidb.MAX_RECONNECT_ATTEMPTS + 1)
+        db, conns = new_loaded_client([], polls=polls)
+
+        with db.init():
+            with pytest.raises(pymysql.err.OperationalError):
+                db.optimize()
+
+        assert polls == []
+        assert len(conns) == 1 + tidb.MAX_RECONNECT_ATTEMPTS
@@ -1,10 +1,12 @@
 """Wrapper around the Pinecone vector database over VectorDB"""
+import re
 import time
 import logging
+from operator import itemgetter
 from contextlib import contextmanager
 from typing import Type
 import pymysql
-from pymysql.cursors import Cursor
+from pymysql.cursors import Cursor, SSCursor
 from pymysql.connections import Connection
 
 from ..api import VectorDB, DBConfig, DBCaseConfig, EmptyDBCaseConfig, IndexType
@@ -13,6 +15,16 @@ from .config import TiDBServerlessConfig
 
 log = logging.getLogger(__name__)
 
+# table names are interpolated into every statement as bare identifiers
+TABLE_NAME_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# upper bound for one multi-row INSERT statement
+MAX_STMT_LENGTH = 16 * 1024 * 1024
+# keep insert transactions well below TiDB's default 100MB txn-total-size-limit
+MAX_TXN_SIZE = 64 * 1024 * 1024
+# consecutive failed TiFlash progress polls tolerated by optimize before giving up
+MAX_RECONNECT_ATTEMPTS = 3
+
 
 class TiDBServeless(VectorDB):
     name = "TiDBServerless"
@@ -26,14 +38,44 @@ class TiDBServeless(VectorDB):
         drop_old: bool = False,
         **kwargs,
     ):
+        if not TABLE_NAME_PATTERN.fullmatch(collection_name):
+            raise ValueError(f"Invalid TiDB table name: {collection_name!r}")
+
         self.dim = dim
         self.table_name = collection_name
         self.case_config = db_case_config
         self.db_config = db_config
+        # vector<float> stores float32, 9 significant digits round-trip it exactly
+        self._vector_fmt = "[" + ",".join(["%.9g"] * dim) + "]"
+        # only digits come out of %d/%g, so rows can be inlined without escaping,
+        # formatted as bytes so the joined statement goes to the socket without an encode pass
+        self._insert_row_fmt = ("(%d,'" + self._vector_fmt + "')").encode()
+        # rows per commit, a row is roughly a float32 vector plus its BIGINT id
+        self._insert_txn_rows = max(1, MAX_TXN_SIZE // (dim * 4 + 64))
+        index_param = self.case_config.index_param()
+        search_param = self.case_config.search_param()
+        self._drop_sql = f'DROP TABLE IF EXISTS {self.table_name}'
+        self._create_sql = f'CREATE TABLE IF NOT EXISTS {self.table_name} (id BIGINT PRIMARY KEY, embedding vector<float>({dim}) COMMENT "hnsw(distance={index_param["metric"]})")'
+        self._compact_sql = f'ALTER TABLE {self.table_name} COMPACT TIFLASH REPLICA'
+        self._insert_sql_prefix = f'INSERT INTO {self.table_name} (id, embedding) VALUES '.encode()
+        self._search_sql = f'SELECT id FROM {self.table_name} ORDER BY {search_param["metric_func"]}(embedding, %s) LIMIT %s'
+
+        self.cursor = None
+        self.conn = None
+        self._max_stmt_length = None
 
         if drop_old:
-            self._drop_table()
-            self._create_table()
+            self.conn = self._ensure_connection()
+            try:
+                self.cursor = self.conn.cursor()
+                self._drop_table()
+                self._create_table()
+            finally:
+                if self.cursor is not None:
+                    self.cursor.close()
+                self.conn.close()
+                self.cursor = None
+                self.conn = None
 
     @contextmanager
     def init(self) -> None:
@@ -43,14 +85,18 @@ class TiDBServeless(VectorDB):
             >>>     self.insert_embeddings()
             >>>     self.search_embedding()
         """
-        conn = self._ensure_connection()
-        cursor = conn.cursor()
-
+        self.conn = self._ensure_connection()
         try:
+            self.cursor = self.conn.cursor()
+            self._max_stmt_length = self._fetch_max_stmt_length()
             yield
         finally:
-            cursor.close()
-            conn.close()
+            if self.cursor is not None:
+                self.cursor.close()
+            self.conn.close()
+            self.cursor = None
+            self.conn = None
+            self._max_stmt_length = None
 
     @classmethod
     def config_cls(cls) -> Type[DBConfig]:
@@ -61,40 +107,76 @@ class TiDBServeless(VectorDB):
         return EmptyDBCaseConfig
 
     def _ensure_connection(self) -> (Connection):
-        conn = pymysql.connect(**self.db_config)
-        conn.autocommit = False
-        return conn
+        # autocommit so searches and progress polls never read from a stale snapshot,
+        # inserts open their own transactions with begin(),
+        # pass it at connect time, Connection.autocommit is a method and must not be overwritten
+        return pymysql.connect(**self.db_config, autocommit=True)
 
-    def _drop_table(self):
+    def _reconnect(self):
+        """Replace the init() connection and cursor after the server dropped them"""
         conn = self._ensure_connection()
-        with conn.cursor() as cursor:
-            try:
-                cursor.execute(f'DROP TABLE IF EXISTS {self.table_name};')
-                conn.commit()
-            except Exception as e:
-                log.warning(f"Failed to drop pgvector table: {self.table_name} error: {e}")
-                raise e from None
+        dropped, self.conn, self.cursor = self.conn, conn, conn.cursor()
+        try:
+            dropped.close()
+        except Exception:
+            pass
+
+    def _fetch_max_stmt_length(self) -> int:
+        """Size multi-row INSERT statements to the server packet limit"""
+        self.cursor.execute('SELECT @@max_allowed_packet')
+        max_allowed_packet = int(self.cursor.fetchone()[0])
+        return min(max_allowed_packet - 1024, MAX_STMT_LENGTH)
+
+    def _drop_table(self):
+        assert self.conn is not None, "Connection is not initialized"
+        assert self.cursor is not None, "Cursor is not initialized"
+
+        try:
+            self.cursor.execute(self._drop_sql)
+            self.conn.commit()
+        except Exception as e:
+            log.warning(f"Failed to drop pgvector table: {self.table_name} error: {e}")
+            raise e from None
 
     def _create_table(self):
-        conn = self._ensure_connection()
-        index_param = self.case_config.index_param()
-        with conn.cursor() as cursor:
-            try:
-                cursor.execute(f'CREATE TABLE IF NOT EXISTS {self.table_name} (id BIGINT PRIMARY KEY, embedding vector<float>({self.dim}) COMMENT "hnsw(distance={index_param["metric"]})" );')
-                conn.commit()
-            except Exception as e:
-                log.warning(f"Failed to create pgvector table: {self.table_name} error: {e}")
-                raise e from None
+        assert self.conn is not None, "Connection is not initialized"
+        assert self.cursor is not None, "Cursor is not initialized"
+
+        try:
+            self.cursor.execute(self._create_sql)
+            self.conn.commit()
+        except Exception as e:
+            log.warning(f"Failed to create pgvector table: {self.table_name} error: {e}")
+            raise e from None
 
     def ready_to_load(self):
         pass
 
     def optimize(self):
+        # back off from a quick first re-check so short replications finish without a fixed 2s wait
+        interval = 0.2
+        attempts = 0
         while True:
-            progress = self._check_tiflash_replica_progress()
+            try:
+                progress = self._check_tiflash_replica_progress()
+                attempts = 0
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError) as e:
+                # long builds can outlive the idle session, wait and poll again on a fresh connection
+                attempts += 1
+                if attempts > MAX_RECONNECT_ATTEMPTS:
+                    raise e from None
+                log.warning(f"Lost connection while checking TiFlash progress, reconnecting ({attempts}/{MAX_RECONNECT_ATTEMPTS}): {e}")
+                time.sleep(interval)
+                interval = min(interval * 1.5, 5)
+                try:
+                    self._reconnect()
+                except pymysql.err.OperationalError as reconnect_error:
+                    log.warning(f"Failed to reconnect to TiDB: {reconnect_error}")
+                continue
             if progress != 1:
                 log.info(f"TiFlash still not ready, progress: {progress}")
-                time.sleep(2)
+                time.sleep(interval)
+                interval = min(interval * 1.5, 5)
             else:
                 break
         # log.info("Begin to compact tiflash replica")
@@ -102,25 +184,48 @@ class TiDBServeless(VectorDB):
         # log.info("Successful compacted tiflash replica")
 
     def _compact_tiflash(self):
-        conn = self._ensure_connection()
-        with conn.cursor() as cursor:
-            try:
-                cursor.execute(f'ALTER TABLE {self.table_name} COMPACT TIFLASH REPLICA')
-                conn.commit()
-            except Exception as e:
-                log.warning(f"Failed to compact table: {self.table_name} error: {e}")
-                raise e from None
+        assert self.conn is not None, "Connection is not initialized"
+        assert self.cursor is not None, "Cursor is not initialized"
+
+        try:
+            self.cursor.execute(self._compact_sql)
+            self.conn.commit()
+        except Exception as e:
+            log.warning(f"Failed to compact table: {self.table_name} error: {e}")
+            raise e from None
 
     def _check_tiflash_replica_progress(self):
-        conn = self._ensure_connection()
+        assert self.conn is not None, "Connection is not initialized"
+        assert self.cursor is not None, "Cursor is not initialized"
+
         database = self.db_config['database']
-        with conn.cursor() as cursor:
-            try:
-                cursor.execute(f'SELECT PROGRESS FROM information_schema.tiflash_replica WHERE TABLE_SCHEMA = "{database}" AND TABLE_NAME = "{self.table_name}"')
-                result = cursor.fetchone()
-                return result[0]
-            except Exception as e:
-                raise e from None
+        try:
+            self.cursor.execute(
+                'SELECT PROGRESS FROM information_schema.tiflash_replica WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s',
+                (database, self.table_name),
+            )
+            result = self.cursor.fetchone()
+            return result[0]
+        except Exception as e:
+            raise e from None
+
+    def _insert_rows(self, cursor: Cursor, rows: list[bytes]):
+        """Execute rows as few multi-row INSERTs as the statement length limit allows"""
+        prefix = self._insert_sql_prefix
+        start, stmt_length = 0, len(prefix)
+        for i, row in enumerate(rows):
+            if i > start and stmt_length + len(row) + 1 > self._max_stmt_length:
+                cursor.execute(prefix + b",".join(rows[start:i]))
+                start, stmt_length = i, len(prefix)
+            stmt_length += len(row) + 1
+        cursor.execute(prefix + b",".join(rows[start:]))
+
+    def _rollback_insert(self):
+        """Rollback without masking the insert error, a dead socket cannot rollback anyway"""
+        try:
+            self.conn.rollback()
+        except Exception as e:
+            log.warning(f"Failed to rollback insert into table ({self.table_name}), error: {e}")
 
     def insert_embeddings(
         self,
@@ -128,24 +233,37 @@ class TiDBServeless(VectorDB):
         metadata: list[int],
         **kwargs,
     ) -> (int, Exception):
-        conn = self._ensure_connection()
-        with conn.cursor() as cursor:
+        assert self.conn is not None, "Connection is not initialized"
+        assert self.cursor is not None, "Cursor is not initialized"
+
+        # rows committed so far, the runner retries from here after an error
+        count = 0
+        try:
+            if len(embeddings) != len(metadata):
+                raise ValueError(f"embeddings and metadata length mismatch: {len(embeddings)} != {len(metadata)}")
+
+            batch_size = 5000
+            # commit every _insert_txn_rows, runner calls of NUM_PER_BATCH rows are a single commit
+            for txn_start in range(0, len(metadata), self._insert_txn_rows):
+                txn_end = min(txn_start + self._insert_txn_rows, len(metadata))
+                self.conn.begin()
+                for i in range(txn_start, txn_end, batch_size):
+                    batch_end = min(i + batch_size, txn_end)
+                    # index in place, slicing would copy both lists for every batch
+                    rows = [self._insert_row_fmt % (metadata[j], *embeddings[j]) for j in range(i, batch_end)]
+                    self._insert_rows(self.cursor, rows)
+                self.conn.commit()
+                count = txn_end
+            return count, None
+        except Exception as e:
+            self._rollback_insert()
+            # the runner retries inside the same init() context, never reuse a possibly dead socket
             try:
-                batch_size = 5000
-                for i in range(0, len(metadata), batch_size):
-                    batch_ids = metadata[i:i+batch_size]
-                    batch_embeddings = embeddings[i:i+batch_size]
-                    if len(batch_ids) == 0:
-                        break
-
-                    batch_embeddings = list(map(lambda x: str(list(x)), batch_embeddings))
-
-                    cursor.executemany(f'INSERT INTO {self.table_name} (id, embedding) VALUES (%s, %s)', list(zip(batch_ids, batch_embeddings)))
-                    conn.commit()
-                return len(metadata), None
-            except Exception as e:
-                log.warning(f"Failed to insert data into pgvector table ({self.table_name}), error: {e}")
-                return 0, e
+                self._reconnect()
+            except pymysql.err.OperationalError as reconnect_error:
+                log.warning(f"Failed to reconnect to TiDB: {reconnect_error}")
+            log.warning(f"Failed to insert data into TiDB table ({self.table_name}), committed {count} rows, error: {e}")
+            return count, e
 
     def search_embedding(        
         self,
@@ -154,9 +272,11 @@ class TiDBServeless(VectorDB):
         filters: dict | None = None,
         timeout: int | None = None,
     ) -> list[int]:
-        search_param =self.case_config.search_param()
-        conn = self._ensure_connection()
-        with conn.cursor() as cursor:
-            cursor.execute(f'SELECT id FROM {self.table_name} ORDER BY {search_param["metric_func"]}(embedding, "{query}") LIMIT {k};')
-            result = cursor.fetchall()
-            return [int(i[0]) for i in result]
+        assert self.conn is not None, "Connection is not initialized"
+        assert self.cursor is not None, "Cursor is not initialized"
+
+        # unbuffered, rows are unpacked as they arrive and iterating drains the result
+        # the BIGINT id column already decodes to int
+        with self.conn.cursor(SSCursor) as cursor:
+            cursor.execute(self._search_sql, (self._vector_fmt % tuple(query), k))
+            return list(map(itemgetter(0), cursor))